@@ -1,9 +1,10 @@
 import streamlit as st
-import pandas as pd
-import random
-from io import BytesIO
-import xlsxwriter
-import json
+from io import BytesIO, StringIO
+from datetime import datetime
+from itertools import groupby
+from typing import Annotated, Literal
+from pydantic import BaseModel, ConfigDict, StringConstraints, ValidationError, field_validator, model_validator
+from pydantic_core import InitErrorDetails
 
 # --- App-Konfiguration ---
 st.set_page_config(page_title="Praxis-Dienstplanung", layout="wide")
@@ -12,76 +13,311 @@ st.title("Praxis-Dienstplanung: Dateninput & Dienstplan")
 # --- Statische Daten (nicht sensibel) ---
 days = ['Montag', 'Dienstag', 'Mittwoch', 'Donnerstag', 'Freitag']
 schifts = ['Vormittag', 'Nachmittag']
+# (Slot-Name, Wochentag, Schicht) einmal beim Import, statt Slot-Namen in den Schleifen zu bauen/splitten
+slot_specs = tuple((f"{d} {s}", d, s) for d in days for s in schifts)
+slots_order = tuple(slot for slot, _, _ in slot_specs)
+slot_idx = {slot: i for i, slot in enumerate(slots_order)}
+
+# --- Config-Schema (einmalig beim Import kompiliert) ---
+Wochentag = Literal[tuple(days)]
+Schicht = Literal[tuple(schifts)]
+SlotKey = Annotated[str, StringConstraints(pattern=rf"^({'|'.join(days)}) ({'|'.join(schifts)})$")]
+# Bereich -> Helferin eines Standard-Slots
+SlotAssignment = dict[str, str]
+# Wochentag -> Schichten (Bedarf eines Bereichs bzw. Verfügbarkeit einer Mitarbeiterin)
+SchichtenProTag = dict[Wochentag, list[Schicht]]
+
+class ConfigReferenceError(ValueError):
+    """Sammelt Querverweis-Fehler, damit sie einzeln angezeigt werden können"""
+    def __init__(self, messages):
+        super().__init__("\n".join(messages))
+        self.messages = messages
+
+def _name_list(value):
+    """Namensliste aus den Rohdaten, None wenn sie nicht nur aus Texten besteht"""
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return value
+    return None
+
+def _reference_errors(data):
+    """Querverweise der Roh-Config; Teile mit falschem Typ überspringen, die meldet das Schema"""
+    errors = []
+    bereiche = _name_list(data.get('bereiche'))
+    mitarbeiter = _name_list(data.get('mitarbeiter'))
+    bereiche_set = set(bereiche) if bereiche is not None else None
+    mitarbeiter_set = set(mitarbeiter) if mitarbeiter is not None else None
+    # Prüfe ob alle Bereiche in bereich_schichten vorhanden sind
+    # (Mengendifferenz; Meldungen nur im seltenen Fehlerfall in Config-Reihenfolge aufbauen)
+    bereich_schichten = data.get('bereich_schichten')
+    if bereiche is not None and isinstance(bereich_schichten, dict):
+        fehlende_bereiche = bereiche_set.difference(bereich_schichten)
+        if fehlende_bereiche:
+            for bereich in bereiche:
+                if bereich in fehlende_bereiche:
+                    errors.append(f"Bereich '{bereich}' fehlt in bereich_schichten")
+    # Für jeden Bereich im Standard-Dienstplan sollte Bereich existieren und Helfer aus mitarbeiter
+    # (Mengen statt Listen: ein Hash-Lookup je Eintrag statt linearer Suche)
+    standard_dienstplan = data.get('standard_dienstplan')
+    if isinstance(standard_dienstplan, dict):
+        for slot_key, assign_map in standard_dienstplan.items():
+            if not isinstance(assign_map, dict):
+                continue
+            for b, h in assign_map.items():
+                if bereiche_set is not None and b not in bereiche_set:
+                    errors.append(f"Standard-Dienstplan: Bereich '{b}' unbekannt im Slot '{slot_key}'")
+                if mitarbeiter_set is not None and isinstance(h, str) and h not in mitarbeiter_set:
+                    errors.append(f"Standard-Dienstplan: Helfer '{h}' unbekannt im Slot '{slot_key}' für Bereich '{b}'")
+    # Prüfe ob alle Mitarbeiter in allen relevanten Mappings vorhanden sind
+    if mitarbeiter is not None:
+        fehlende_mitarbeiter = {
+            name: mitarbeiter_set.difference(data[name])
+            for name in ('mitarbeiter_verfuegbarkeit', 'mitarbeiter_bereiche', 'mitarbeiter_max_stunden')
+            if isinstance(data.get(name), dict)
+        }
+        if any(fehlende_mitarbeiter.values()):
+            for helfer in mitarbeiter:
+                for name, fehlend in fehlende_mitarbeiter.items():
+                    if helfer in fehlend:
+                        errors.append(f"Mitarbeiter '{helfer}' fehlt in {name}")
+    return errors
+
+class SpezialRegeln(BaseModel):
+    """Optionale Sonderregeln des Planers; weitere Schlüssel bleiben erhalten"""
+    model_config = ConfigDict(extra='allow')
+
+    rezeption_prioritaet: str | None = None
+
+class PraxisConfig(BaseModel):
+    """Schema der Praxis-Konfigurationsdatei"""
+    model_config = ConfigDict(extra='allow')
+
+    bereiche: list[str]
+    mitarbeiter: list[str]
+    bereich_schichten: dict[str, SchichtenProTag]
+    bereich_mitarbeiter: dict[str, list[str]]
+    mitarbeiter_verfuegbarkeit: dict[str, SchichtenProTag]
+    mitarbeiter_bereiche: dict[str, list[str]]
+    mitarbeiter_max_stunden: dict[str, int]
+    standard_dienstplan: dict[SlotKey, SlotAssignment]
+    spezial_regeln: SpezialRegeln = SpezialRegeln()
+    meta: dict = {}
+
+    @field_validator('bereich_schichten', 'mitarbeiter_verfuegbarkeit')
+    @classmethod
+    def fill_missing_days(cls, value):
+        # Fehlende Wochentage einmalig beim Laden ergänzen, damit die UI direkt indizieren kann
+        return {name: {d: per_day.get(d, []) for d in days} for name, per_day in value.items()}
+
+    @model_validator(mode='wrap')
+    @classmethod
+    def check_references(cls, data, handler):
+        # wrap statt after: Querverweise auch dann prüfen, wenn einzelne Felder ungültig sind
+        # (z.B. ein falsches Slot-Format), damit alle Fehler in einem Durchlauf gemeldet werden
+        try:
+            model = handler(data)
+            field_errors = []
+        except ValidationError as exc:
+            model = None
+            field_errors = [
+                InitErrorDetails(type=err['type'], loc=err['loc'], input=err['input'], ctx=err['ctx'])
+                if 'ctx' in err else
+                InitErrorDetails(type=err['type'], loc=err['loc'], input=err['input'])
+                for err in exc.errors()
+            ]
+        errors = _reference_errors(data) if isinstance(data, dict) else []
+        if errors:
+            field_errors.append(InitErrorDetails(
+                type='value_error', loc=(), input=data, ctx={'error': ConfigReferenceError(errors)}
+            ))
+        if field_errors:
+            raise ValidationError.from_exception_data(cls.__name__, field_errors)
+        return model
 
 # --- Config File Loader ---
 def load_config(uploaded_file):
-    """Lädt und validiert die Konfigurationsdatei"""
+    """Lädt und validiert die Konfigurationsdatei, liefert (PraxisConfig oder None, fehler)"""
+    # getvalue() liefert den vorhandenen Upload-Puffer als bytes, ohne read()-Schleife und
+    # ohne die Dateiposition zu verschieben (kein seek(0) für spätere Reruns nötig)
+    return _load_and_validate(uploaded_file.getvalue())
+
+@st.cache_data(show_spinner=False)
+def _load_and_validate(config_bytes):
+    """Parst und validiert die Config in einem Durchlauf, einmal pro Dateiinhalt (Cache-Key: Bytes)"""
     try:
-        config = json.load(uploaded_file)
-        # Basis-Validierung
-        required_keys = [
-            'bereiche', 'mitarbeiter', 'bereich_schichten',
-            'bereich_mitarbeiter', 'mitarbeiter_verfuegbarkeit',
-            'mitarbeiter_bereiche', 'mitarbeiter_max_stunden',
-            'standard_dienstplan'
-        ]
-        for key in required_keys:
-            if key not in config:
-                st.error(f"Fehlender Schlüssel in Config: {key}")
-                return None
-        return config
-    except json.JSONDecodeError as e:
-        st.error(f"JSON-Fehler: {e}")
-        return None
-    except Exception as e:
-        st.error(f"Fehler beim Laden der Config: {e}")
-        return None
-
-def validate_config(config):
-    """Erweiterte Validierung der Config-Struktur"""
+        return PraxisConfig.model_validate_json(config_bytes), []
+    except ValidationError as exc:
+        return None, _format_validation_errors(exc)
+
+def _format_validation_errors(exc):
+    """Übersetzt pydantic-Fehler in die gewohnten Meldungen"""
     errors = []
-    # Prüfe ob alle Bereiche in bereich_schichten vorhanden sind
-    for bereich in config['bereiche']:
-        if bereich not in config['bereich_schichten']:
-            errors.append(f"Bereich '{bereich}' fehlt in bereich_schichten")
-    # Prüfe Standard-Dienstplan Struktur
-    std = config.get('standard_dienstplan', {})
-    # Jeder Slot-Schlüssel muss "<Wochentag> <Schicht>" sein
-    for slot_key, assign_map in std.items():
-        # Prüfe Format: "Montag Vormittag" etc.
-        parts = slot_key.split()
-        if len(parts) != 2 or parts[0] not in days or parts[1] not in schifts:
-            errors.append(f"Ungültiges Standard-Slot-Format: '{slot_key}'")
-        # Für jeden Bereich in assign_map sollte Bereich existieren und Helfer aus mitarbeiter
-        for b, h in assign_map.items():
-            if b not in config['bereiche']:
-                errors.append(f"Standard-Dienstplan: Bereich '{b}' unbekannt im Slot '{slot_key}'")
-            if h not in config['mitarbeiter']:
-                errors.append(f"Standard-Dienstplan: Helfer '{h}' unbekannt im Slot '{slot_key}' für Bereich '{b}'")
-    # Prüfe ob alle Mitarbeiter in allen relevanten Mappings vorhanden sind
-    for mitarbeiter in config['mitarbeiter']:
-        if mitarbeiter not in config['mitarbeiter_verfuegbarkeit']:
-            errors.append(f"Mitarbeiter '{mitarbeiter}' fehlt in mitarbeiter_verfuegbarkeit")
-        if mitarbeiter not in config['mitarbeiter_bereiche']:
-            errors.append(f"Mitarbeiter '{mitarbeiter}' fehlt in mitarbeiter_bereiche")
-        if mitarbeiter not in config['mitarbeiter_max_stunden']:
-            errors.append(f"Mitarbeiter '{mitarbeiter}' fehlt in mitarbeiter_max_stunden")
+    for err in exc.errors():
+        ctx_error = err.get('ctx', {}).get('error')
+        if isinstance(ctx_error, ConfigReferenceError):
+            errors.extend(ctx_error.messages)
+        elif err['type'] == 'json_invalid':
+            errors.append(f"JSON-Fehler: {ctx_error}")
+        elif err['type'] == 'missing' and len(err['loc']) == 1:
+            errors.append(f"Fehlender Schlüssel in Config: {err['loc'][0]}")
+        elif err['type'] == 'string_pattern_mismatch' and err['loc'][0] == 'standard_dienstplan':
+            errors.append(f"Ungültiges Standard-Slot-Format: '{err['input']}'")
+        else:
+            loc = '.'.join(str(part) for part in err['loc'])
+            errors.append(f"{loc}: {err['msg']}" if loc else err['msg'])
     return errors
 
-# --- Excel Export Funktion ---
+# --- Demand-Matrix (Cache sitzt auf build_plan) ---
+def _build_demand(bereich_shifts):
+    """Liefert Slot -> Menge der Bereiche mit Bedarf aus ((bereich, ((tag, schichten), ...)), ...)"""
+    demand = {slot: set() for slot in slots_order}
+    for b, day_shifts in bereich_shifts:
+        for d, shifts in day_shifts:
+            for s in shifts:
+                demand[f"{d} {s}"].add(b)
+    return demand
+
+def _demand_frame(demand, slots_order, bereiche):
+    """Bool-DataFrame (Slot x Bereich) aus dem Demand-Mapping für Anzeige und Export"""
+    import pandas as pd
+    import numpy as np
+    # Nur die gesetzten Zellen schreiben statt jede (Slot, Bereich)-Kombination abzufragen
+    bereich_idx = {b: j for j, b in enumerate(bereiche)}
+    arr = np.zeros((len(slots_order), len(bereiche)), dtype=bool)
+    for i, slot in enumerate(slots_order):
+        arr[i, [bereich_idx[b] for b in demand[slot]]] = True
+    return pd.DataFrame(arr, index=slots_order, columns=bereiche)
+
+def _unfilled_mask(df_pivot, df_demand):
+    """Bool-Array: geforderte, aber unbesetzte Zellen ('-') des Pivots"""
+    demand = df_demand.reindex(
+        index=df_pivot.index, columns=df_pivot.columns, fill_value=False
+    ).to_numpy(dtype=bool)
+    return demand & (df_pivot.to_numpy() == '-')
+
+# --- Planer (gecacht wie die Exporte: wenige Einträge genügen) ---
+@st.cache_data(max_entries=8, show_spinner=False)
+def build_plan(bereich_shifts, bereich_helpers, helpers, standard_plan, rezeption_prioritaet):
+    """Erstellt den Wochenplan und liefert (plan, df_pivot, df_demand).
+
+    bereich_shifts: ((bereich, ((tag, schichten), ...)), ...) der ausgewählten Bereiche
+    bereich_helpers: ((bereich, helferinnen), ...) in derselben Reihenfolge
+    helpers: ((helferin, max_stunden, ((tag, schichten), ...), einsatzbereiche), ...)
+    """
+    import pandas as pd
+    import numpy as np
+
+    selected_bereiche = [b for b, _ in bereich_shifts]
+    plan = []
+
+    # **Demand-Matrix aufbauen** (welche Bereiche an welchen Slots Bedarf haben)
+    demand = _build_demand(bereich_shifts)
+
+    # 1) Zuweisungen gemäß Standard-Dienstplan (so strikt wie möglich)
+    # Wir gehen über alle Slots; pro Slot über alle Bereiche
+    assignments = {slot: {} for slot in slots_order}  # temporär: slot -> {bereich: helferin}
+
+    # Zähle verfügbare Stunden pro Helferin
+    helper_hours_left = {h: max_h for h, max_h, _, _ in helpers}
+
+    # Statische Eignung einmal vorab: verfügbar im Slot, Bereich passt, Helfer in Bereichsliste
+    helpers_available = {(d, s): set() for d in days for s in schifts}
+    for h, _, times, _ in helpers:
+        for d, shifts in times:
+            for s in shifts:
+                helpers_available[(d, s)].add(h)
+    helpers_for_bereich = {
+        b: set(b_helpers) & {h for h, _, _, areas in helpers if b in areas}
+        for b, b_helpers in bereich_helpers
+    }
+    # Knappheits-Reihenfolge einmal global: Helfer mit wenigen Einsatzbereichen zuerst
+    scarcity_order = [h for h, _, _, _ in sorted(helpers, key=lambda hc: len(hc[3]))]
+    # Rezeptionsbereiche einmal bestimmen statt startswith je (Slot, Bereich)
+    rezeption_bereiche = frozenset(b for b in selected_bereiche if b.startswith('Rezeption'))
+    # Nur Zellen mit Bedarf durchlaufen: (Slot, Wochentag, Schicht, Bereich) in Planungsreihenfolge
+    active_cells = [
+        (slot, d, s, b)
+        for slot, d, s in slot_specs
+        for b in selected_bereiche if b in demand[slot]
+    ]
+
+    # Kandidaten je (Slot, Bereich) als gefilterte Knappheits-Reihenfolge
+    candidates_by_slot = {}
+    for slot, d, s, b in active_cells:
+        eligible = helpers_available[(d, s)] & helpers_for_bereich[b]
+        candidates = [h for h in scarcity_order if h in eligible]
+        # Falls Bereich Rezeption und Priorität gegeben, z.B. "Eva": Priorität zuerst
+        if b in rezeption_bereiche and rezeption_prioritaet in eligible:
+            candidates.remove(rezeption_prioritaet)
+            candidates.insert(0, rezeption_prioritaet)
+        candidates_by_slot[(slot, b)] = candidates
+
+    # Helfer, die je Slot schon belegt sind
+    used_by_slot = {slot: set() for slot in slots_order}
+    # Pivot-Raster direkt während der Zuweisung füllen (unbesetzt = '-')
+    bereich_idx = {b: j for j, b in enumerate(selected_bereiche)}
+    grid = np.full((len(slots_order), len(selected_bereiche)), '-', dtype=object)
+
+    # Die Standardzuweisungen aller Slots laufen vor dem Auffüllen, weil die Stunden
+    # slotübergreifend geteilt werden und der Standard-Dienstplan Vorrang hat
+    for slot, d, s, b in active_cells:
+        std_h = standard_plan.get(slot, {}).get(b, None)
+        # Voraussetzungen: noch Stunden verfügbar, Schicht wählbar, Bereich passt, Helfer in Bereichsliste
+        if (std_h in helpers_available[(d, s)]
+            and std_h in helpers_for_bereich[b]
+            and helper_hours_left[std_h] > 0
+            and std_h not in used_by_slot[slot]):
+            # Zuweisung fest übernehmen
+            assignments[slot][b] = std_h
+            grid[slot_idx[slot], bereich_idx[b]] = std_h
+            used_by_slot[slot].add(std_h)
+            helper_hours_left[std_h] -= 1
+
+    # 2) Auffüllen der übrigen Bedarfslücken nach Knappheit
+    for slot, _, _, b in active_cells:
+        # Nur Bereiche ohne Standardzuweisung
+        if b not in assignments[slot]:
+            used_this_slot = used_by_slot[slot]
+            # Nur noch dynamische Bedingungen prüfen: Stunden übrig, nicht schon im Slot
+            chosen = None
+            for h in candidates_by_slot[(slot, b)]:
+                if helper_hours_left[h] > 0 and h not in used_this_slot:
+                    chosen = h
+                    break
+
+            if chosen:
+                assignments[slot][b] = chosen
+                grid[slot_idx[slot], bereich_idx[b]] = chosen
+                used_this_slot.add(chosen)
+                helper_hours_left[chosen] -= 1
+
+    # 3) Baue plan-Liste für DataFrame (Slot, Bereich, Helferin)
+    for slot, asg_map in assignments.items():
+        for b, h in asg_map.items():
+            plan.append({'Slot': slot, 'Bereich': b, 'Helferin': h})
+
+    df_demand = _demand_frame(demand, slots_order, selected_bereiche)
+    df_pivot = pd.DataFrame(
+        grid,
+        index=pd.Index(slots_order, name='Slot'),
+        columns=pd.Index(selected_bereiche, name='Bereich')
+    )
+    return plan, df_pivot, df_demand
+
+# --- Export Funktionen (gecacht: gleicher Plan -> gleiche Bytes; wenige Einträge genügen) ---
+@st.cache_data(max_entries=8, show_spinner=False)
 def create_excel_export(df_pivot, df_demand, plan_data=None):
     """Erstellt eine Excel-Datei mit dem Dienstplan und markiert unbesetzte, aber geforderte Slots rot."""
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        # Haupttabelle schreiben
-        df_pivot.to_excel(writer, sheet_name='Dienstplan', index=True)
-        # Falls Raw-Daten verfügbar sind, als zweites Sheet hinzufügen
-        if plan_data:
-            df_raw = pd.DataFrame(plan_data)
-            df_raw.to_excel(writer, sheet_name='Raw_Data', index=False)
+    import xlsxwriter  # erst beim Export laden; alle Zellen werden direkt geschrieben
 
-        workbook  = writer.book
-        worksheet = writer.sheets['Dienstplan']
+    output = BytesIO()
+    # constant_memory: xlsxwriter schreibt jede Zeile beim Wechsel sofort weg,
+    # daher wird jedes Sheet strikt zeilenweise von oben nach unten geschrieben.
+    # strings_to_urls/strings_to_formulas=False sparen die Erkennung bei jeder Textzelle
+    # (Namen wie "=..." landen so als Text statt als Formel in der Datei).
+    with xlsxwriter.Workbook(output, {'constant_memory': True,
+                                      'strings_to_formulas': False,
+                                      'strings_to_urls': False}) as workbook:
+        worksheet = workbook.add_worksheet('Dienstplan')
 
         # Formate
         header_fmt = workbook.add_format({
@@ -97,41 +333,77 @@ def create_excel_export(df_pivot, df_demand, plan_data=None):
 
         # Spaltenbreite
         worksheet.set_column('A:A', 15)
-        for col in range(1, len(df_pivot.columns) + 1):
-            worksheet.set_column(col, col, 12)
-
-        # Header + Index
-        for c, col in enumerate(df_pivot.columns, start=1):
-            worksheet.write(0, c, col, header_fmt)
-        for r, idx in enumerate(df_pivot.index, start=1):
-            worksheet.write(r, 0, idx, header_fmt)
-
-        # Nur geforderte & unbesetzte Slots rot
-        rows, cols = df_pivot.shape
-        for r in range(rows):
-            slot = df_pivot.index[r]
-            for c in range(cols):
-                bereich = df_pivot.columns[c]
-                val = df_pivot.iat[r, c]
-                # Wenn Demand True und kein Helfer ("-"), dann rot, sonst normal
-                fmt = red_fmt if (df_demand.at[slot, bereich] and val == '-') else cell_fmt
-                worksheet.write(r+1, c+1, val, fmt)
+        worksheet.set_column(1, len(df_pivot.columns), 12)
+        # Kopfzeile und Slot-Spalte beim Scrollen fixieren
+        worksheet.freeze_panes(1, 1)
+
+        # Header
+        if df_pivot.index.name is not None:
+            worksheet.write(0, 0, df_pivot.index.name)
+        worksheet.write_row(0, 1, list(df_pivot.columns), header_fmt)
+
+        # Nur geforderte & unbesetzte Slots rot: Maske einmal vektorisiert berechnen
+        vals = df_pivot.to_numpy()
+        red_mask = _unfilled_mask(df_pivot, df_demand)
+        # Index-Zelle zeilenweise mit den Daten (write_column würde constant_memory verletzen)
+        for r, idx in enumerate(df_pivot.index):
+            worksheet.write(r+1, 0, idx, header_fmt)
+            # Zusammenhängende Zellen gleichen Formats mit einem write_row-Aufruf
+            c = 0
+            for is_red, run in groupby(red_mask[r]):
+                n = sum(1 for _ in run)
+                worksheet.write_row(r+1, c+1, vals[r, c:c+n].tolist(), red_fmt if is_red else cell_fmt)
+                c += n
+
+        # Falls Raw-Daten verfügbar sind, als zweites Sheet hinzufügen
+        if plan_data:
+            raw_sheet = workbook.add_worksheet('Raw_Data')
+            raw_cols = list(plan_data[0])
+            raw_sheet.write_row(0, 0, raw_cols)
+            for r, entry in enumerate(plan_data, start=1):
+                raw_sheet.write_row(r, 0, [entry[k] for k in raw_cols])
 
     return output.getvalue()
 
+@st.cache_data(max_entries=8, show_spinner=False)
+def create_csv_export(df_pivot):
+    """Erstellt den Dienstplan als CSV-Text; download_button kodiert str selbst als UTF-8."""
+    return df_pivot.to_csv(index=True)
+
+# Statischer Rahmen der HTML-Druckansicht; nur Zeitstempel und Tabelle sind variabel
+_HTML_HEADER = """
+<!DOCTYPE html><html><head><title>Dienstplan</title>
+<style>#dienstplan{border-collapse:collapse;width:100%;}
+#dienstplan th,#dienstplan td{border:1px solid #ddd;padding:8px;text-align:center;}
+#dienstplan th{background-color:#f2f2f2;font-weight:bold;}
+@media print{body{margin:0;}}</style></head><body>
+<h1>Wöchentlicher Dienstplan</h1>
+<p>Erstellt am: {TS}</p>
+"""
+_HTML_FOOTER = """
+</body></html>
+"""
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def create_html_export(df_pivot, created_at):
+    """Erstellt eine druckfreundliche HTML-Seite mit dem Dienstplan."""
+    # Tabelle direkt in den Puffer schreiben statt als Zwischen-String in ein Template einzusetzen
+    buf = StringIO()
+    buf.write(_HTML_HEADER.replace('{TS}', created_at))
+    df_pivot.to_html(buf=buf, table_id="dienstplan")
+    buf.write(_HTML_FOOTER)
+    return buf.getvalue()
+
 # --- Session State Initialisierung ---
-if 'config_loaded' not in st.session_state:
-    st.session_state.config_loaded = False
-if 'config_data' not in st.session_state:
-    st.session_state.config_data = None
-if 'bereiche_cfg' not in st.session_state:
-    st.session_state.bereiche_cfg = {}
-if 'helpers_cfg' not in st.session_state:
-    st.session_state.helpers_cfg = {}
-if 'current_plan' not in st.session_state:
-    st.session_state.current_plan = None
-if 'current_pivot' not in st.session_state:
-    st.session_state.current_pivot = None
+for key, default in {
+    'config_loaded': False,
+    'config_data': None,
+    'bereiche_cfg': {},
+    'helpers_cfg': {},
+    'current_plan': None,
+    'current_pivot': None,
+}.items():
+    st.session_state.setdefault(key, default)
 
 # --- CONFIG FILE UPLOAD SECTION ---
 st.header("🔧 Konfiguration laden")
@@ -142,33 +414,35 @@ if not st.session_state.config_loaded:
         help="Lade deine Klinik_config2.json Datei hoch"
     )
     if uploaded_file is not None:
-        config = load_config(uploaded_file)
-        if config:
-            validation_errors = validate_config(config)
-            if validation_errors:
-                st.error("❌ Validierungsfehler in der Config:")
-                for e in validation_errors:
-                    st.error(f"• {e}")
-            else:
-                st.session_state.config_data = config
-                st.session_state.config_loaded = True
-                st.success("✅ Konfiguration erfolgreich geladen!")
+        config, validation_errors = load_config(uploaded_file)
+        if validation_errors:
+            st.error("❌ Validierungsfehler in der Config:")
+            for e in validation_errors:
+                st.error(f"• {e}")
+        else:
+            st.session_state.config_data = config
+            st.session_state.config_loaded = True
+            st.success("✅ Konfiguration erfolgreich geladen!")
 
 # --- HAUPT-APP (nur wenn Config geladen) ---
 if st.session_state.config_loaded and st.session_state.config_data:
+    # pandas/numpy erst laden, wenn sie gebraucht werden (schnellerer Kaltstart des Uploads)
+    import pandas as pd
+    import numpy as np
+
     config = st.session_state.config_data
 
     # Config-Daten extrahieren
-    bereiche_list = config['bereiche']
-    arzthelfer_list = config['mitarbeiter']
-    default_shifts_map = config['bereich_schichten']
-    default_helpers_map = config['bereich_mitarbeiter']
-    default_helper_shifts_map = config['mitarbeiter_verfuegbarkeit']
-    default_areas_map = config['mitarbeiter_bereiche']
-    default_max_hours = config['mitarbeiter_max_stunden']
-    standard_plan = config['standard_dienstplan']
-    spezial_regeln = config.get('spezial_regeln', {})
-    rezeption_prioritaet = spezial_regeln.get('rezeption_prioritaet', None)
+    bereiche_list = config.bereiche
+    arzthelfer_list = config.mitarbeiter
+    default_shifts_map = config.bereich_schichten
+    default_helpers_map = config.bereich_mitarbeiter
+    default_helper_shifts_map = config.mitarbeiter_verfuegbarkeit
+    default_areas_map = config.mitarbeiter_bereiche
+    default_max_hours = config.mitarbeiter_max_stunden
+    standard_plan = config.standard_dienstplan
+    spezial_regeln = config.spezial_regeln
+    rezeption_prioritaet = spezial_regeln.rezeption_prioritaet
 
     # --- Config-Info anzeigen ---
     with st.expander("📋 Geladene Konfiguration"):
@@ -178,231 +452,157 @@ if st.session_state.config_loaded and st.session_state.config_data:
         with col2:
             st.metric("Mitarbeiter", len(arzthelfer_list))
         with col3:
-            praxis_name = config.get('meta', {}).get('praxis_name', 'Unbekannt')
+            praxis_name = config.meta.get('praxis_name', 'Unbekannt')
             st.metric("Praxis", praxis_name)
 
-    # --- 1. Bereiche konfigurieren ---
-    st.header("1. Bereiche konfigurieren")
-    selected_bereiche = st.multiselect(
-        "Bereiche auswählen", bereiche_list, default=bereiche_list
-    )
-    for bereich in selected_bereiche:
-        with st.expander(bereich):
-            shifts = {}
-            defaults = default_shifts_map.get(bereich, {d: [] for d in days})
-            for d in days:
-                sel = st.multiselect(
-                    f"Schichten am {d}", schifts,
-                    default=defaults.get(d, []),
-                    key=f"sh_{bereich}_{d}"
-                )
-                shifts[d] = sel
-            helpers = st.multiselect(
-                f"Arzthelferinnen für {bereich}", arzthelfer_list,
-                default=default_helpers_map.get(bereich, []),
-                key=f"h_{bereich}"
-            )
+    # Slot-Spalten der Editor-Tabellen
+    slot_columns = {slot: st.column_config.CheckboxColumn(slot) for slot in slots_order}
+
+    # Formular: Änderungen an Auswahl und Tabellen lösen erst beim Übernehmen einen Rerun aus
+    with st.form("cfg_form"):
+        # --- 1. Bereiche konfigurieren ---
+        st.header("1. Bereiche konfigurieren")
+        # Eine Tabelle (ein Widget) statt Multiselects pro Bereich und Tag. Alle Bereiche bleiben
+        # als Zeilen stehen und werden über "Aktiv" gewählt: die Tabellendaten ändern sich so nicht
+        # mit der Auswahl, und bereits gemachte Änderungen gehen nicht verloren.
+        # Validierung garantiert Einträge für alle Bereiche/Mitarbeiter
+        bereiche_df = pd.DataFrame(
+            {
+                'Aktiv': True,
+                **{slot: [s in default_shifts_map[b][d] for b in bereiche_list]
+                   for slot, d, s in slot_specs},
+                'Arzthelferinnen': [list(default_helpers_map.get(b, [])) for b in bereiche_list],
+            },
+            index=pd.Index(bereiche_list, name='Bereich'),
+        )
+        bereiche_edit = st.data_editor(
+            bereiche_df,
+            key="bereiche_grid",
+            column_config={
+                'Aktiv': st.column_config.CheckboxColumn("Aktiv"),
+                **slot_columns,
+                'Arzthelferinnen': st.column_config.MultiselectColumn(
+                    "Arzthelferinnen", options=arzthelfer_list
+                ),
+            },
+        )
+        selected_bereiche = []
+        for bereich, row in bereiche_edit.to_dict('index').items():
+            if not row['Aktiv']:
+                continue
+            selected_bereiche.append(bereich)
+            # frozenset: der Planer prüft nur Mitgliedschaft; geleerte Zellen kommen als None
             st.session_state.bereiche_cfg[bereich] = {
-                'shifts': shifts,
-                'helpers': helpers
+                'shifts': {d: [s for s in schifts if row[f"{d} {s}"]] for d in days},
+                'helpers': frozenset(row['Arzthelferinnen'] or ())
             }
 
-    # --- 2. Arzthelferinnen konfigurieren ---
-    st.header("2. Arzthelferinnen konfigurieren")
-    selected_helpers = st.multiselect(
-        "Arzthelferinnen auswählen", arzthelfer_list, default=arzthelfer_list
-    )
-    for h in selected_helpers:
-        with st.expander(h):
-            max_h = st.number_input(
-                f"Max. Stunden/Woche {h}", 0, 60,
-                default_max_hours.get(h, 40),
-                key=f"mh_{h}"
-            )
-            times = {}
-            h_defaults = default_helper_shifts_map.get(h, {d: [] for d in days})
-            for d in days:
-                sel = st.multiselect(
-                    f"Einsatz am {d}", schifts,
-                    default=h_defaults.get(d, []),
-                    key=f"ts_{h}_{d}"
-                )
-                times[d] = sel
-            areas = st.multiselect(
-                f"Einsatzbereiche für {h}", bereiche_list,
-                default=default_areas_map.get(h, []),
-                key=f"a_{h}"
-            )
-            st.session_state.helpers_cfg[h] = {
-                'max_hours': max_h,
-                'times': times,
-                'areas': areas
+        # --- 2. Arzthelferinnen konfigurieren ---
+        st.header("2. Arzthelferinnen konfigurieren")
+        helpers_df = pd.DataFrame(
+            {
+                'Aktiv': True,
+                'Max. Stunden': [default_max_hours[h] for h in arzthelfer_list],
+                **{slot: [s in default_helper_shifts_map[h][d] for h in arzthelfer_list]
+                   for slot, d, s in slot_specs},
+                'Einsatzbereiche': [list(default_areas_map[h]) for h in arzthelfer_list],
+            },
+            index=pd.Index(arzthelfer_list, name='Mitarbeiter'),
+        )
+        helpers_edit = st.data_editor(
+            helpers_df,
+            key="helpers_grid",
+            column_config={
+                'Aktiv': st.column_config.CheckboxColumn("Aktiv"),
+                'Max. Stunden': st.column_config.NumberColumn(
+                    "Max. Stunden/Woche", min_value=0, max_value=60, step=1, required=True
+                ),
+                **slot_columns,
+                'Einsatzbereiche': st.column_config.MultiselectColumn(
+                    "Einsatzbereiche", options=bereiche_list
+                ),
+            },
+        )
+        # Nur aktive Mitarbeiterinnen planen: der Planer läuft über alle Einträge von helpers_cfg
+        st.session_state.helpers_cfg = {
+            h: {
+                'max_hours': int(row['Max. Stunden']),
+                'times': {d: frozenset(s for s in schifts if row[f"{d} {s}"]) for d in days},
+                'areas': frozenset(row['Einsatzbereiche'] or ())
             }
+            for h, row in helpers_edit.to_dict('index').items() if row['Aktiv']
+        }
+
+        st.form_submit_button("Konfiguration übernehmen")
 
     # --- 3. Dienstplan generieren ---
     st.header("3. Dienstplan generieren")
+    include_raw_data = st.checkbox(
+        "Raw-Data-Sheet in Excel-Export aufnehmen", value=True,
+        help="Zusätzliches Sheet mit allen Zuweisungen als Liste (Slot, Bereich, Helferin)"
+    )
     if st.button("Plan erstellen"):
-        plan = []
-        # Tracke, wie oft jede Helferin schon eingeteilt wurde (Stunden)
-        used_helpers = {(d, s): set() for d in days for s in schifts}
-        slots_order = [f"{d} {s}" for d in days for s in schifts]
-
-        # **Demand-Matrix aufbauen** (welche Bereiche an welchen Slots Bedarf haben)
-        df_demand = pd.DataFrame(False, index=slots_order, columns=selected_bereiche)
-        for b, cfg in st.session_state.bereiche_cfg.items():
-            for d in days:
-                for s in cfg['shifts'][d]:
-                    df_demand.at[f"{d} {s}", b] = True
-
-        # 1) Zuweisungen gemäß Standard-Dienstplan (so strikt wie möglich)
-        # Wir gehen über alle Slots; pro Slot über alle Bereiche
-        assignments = {slot: {} for slot in slots_order}  # temporär: slot -> {bereich: helferin}
-
-        # Zähle verfügbare Stunden pro Helferin
-        helper_hours_left = {h: st.session_state.helpers_cfg[h]['max_hours']
-                             for h in st.session_state.helpers_cfg}
-
-        # Behalte Hilfsstruktur: Helfer-Verfügbarkeit & -Einsatzbereiche aus Session State
-        helpers_cfg = st.session_state.helpers_cfg
-
-        for slot in slots_order:
-            # Zerlegen in Wochentag und Schicht
-            d, s = slot.split()
-            used_this_slot = set()  # Helfer, die schon in diesem Slot belegt wurden
-            # 1a) Versuche, Standardzuweisung durchzuführen
-            std_map = standard_plan.get(slot, {})
-            for b in selected_bereiche:
-                # Nur wenn Bereich für diesen Slot überhaupt Bedarf hat
-                if df_demand.at[slot, b]:
-                    std_h = std_map.get(b, None)
-                    if std_h:
-                        # Prüfe, ob diese Helferin noch frei und verfügbar ist
-                        cfg_h = helpers_cfg.get(std_h, None)
-                        if cfg_h:
-                            # Voraussetzungen: noch Stunden verfügbar, Schicht wählbar, Bereich passt, Helfer in Bereichsliste
-                            if (helper_hours_left[std_h] > 0
-                                and s in cfg_h['times'][d]
-                                and b in cfg_h['areas']
-                                and std_h in st.session_state.bereiche_cfg[b]['helpers']
-                                and std_h not in used_this_slot):
-                                # Zuweisung fest übernehmen
-                                assignments[slot][b] = std_h
-                                used_this_slot.add(std_h)
-                                helper_hours_left[std_h] -= 1
-
-            # 1b) Standardzuweisungen hinzugefügt - markiere als verwendet
-            for b, h in assignments[slot].items():
-                used_helpers[(d, s)].add(h)
-
-        # 2) Auffüllen der übrigen Bedarfslücken nach Knappheit
-        for slot in slots_order:
-            d, s = slot.split()
-            used_this_slot = used_helpers[(d, s)]
-            for b in selected_bereiche:
-                if df_demand.at[slot, b]:
-                    # Wenn noch keine Standardzuweisung existiert
-                    if b not in assignments[slot]:
-                        # Kandidatenliste: Helfer, die noch Stunden haben, verfügbar sind, im Bereich arbeiten, nicht schon in Slot, und in Bereichshelfer-Liste
-                        candidates = [
-                            h for h, cfg_h in helpers_cfg.items()
-                            if helper_hours_left[h] > 0
-                               and s in cfg_h['times'][d]
-                               and b in cfg_h['areas']
-                               and h in st.session_state.bereiche_cfg[b]['helpers']
-                               and h not in used_this_slot
-                        ]
-                        # Sortiere nach Knappheit: Helfer mit wenigen Einsatzbereichen zuerst
-                        candidates_sorted = sorted(
-                            candidates,
-                            key=lambda h: len(helpers_cfg[h]['areas'])
-                        )
-
-                        chosen = None
-                        if candidates_sorted:
-                            # Falls Bereich Rezeption und Priorität gegeben, z.B. "Eva"
-                            if b.startswith('Rezeption') and rezeption_prioritaet in candidates_sorted:
-                                chosen = rezeption_prioritaet
-                            else:
-                                chosen = candidates_sorted[0]
-
-                        if chosen:
-                            assignments[slot][b] = chosen
-                            used_this_slot.add(chosen)
-                            helper_hours_left[chosen] -= 1
-
-            # Setze im used_helpers für diesen Slot die finalen Helfer ein
-            for h in used_this_slot:
-                used_helpers[(d, s)].add(h)
-
-        # 3) Baue plan-Liste für DataFrame (Slot, Bereich, Helferin)
-        for slot, asg_map in assignments.items():
-            for b, h in asg_map.items():
-                plan.append({'Slot': slot, 'Bereich': b, 'Helferin': h})
+        bereiche_cfg = st.session_state.bereiche_cfg
+        # Hashbare, reihenfolgetreue Eingaben für den gecachten Planer (Mengen als sortierte Tupel)
+        plan, df_pivot, df_demand = build_plan(
+            tuple(
+                (b, tuple((d, tuple(bereiche_cfg[b]['shifts'][d])) for d in days))
+                for b in selected_bereiche
+            ),
+            tuple((b, tuple(sorted(bereiche_cfg[b]['helpers']))) for b in selected_bereiche),
+            tuple(
+                (h, cfg_h['max_hours'],
+                 tuple((d, tuple(sorted(cfg_h['times'][d]))) for d in days),
+                 tuple(sorted(cfg_h['areas'])))
+                for h, cfg_h in st.session_state.helpers_cfg.items()
+            ),
+            standard_plan,
+            rezeption_prioritaet,
+        )
 
         if plan:
-            df_plan = pd.DataFrame(plan)
-            df_pivot = (
-                df_plan
-                .pivot(index='Slot', columns='Bereich', values='Helferin')
-                .reindex(index=slots_order, columns=selected_bereiche)
-                .fillna('-')
-            )
             # Plan in Session State speichern
             st.session_state.current_plan = plan
             st.session_state.current_pivot = df_pivot
 
             # Anzeige: Nur wirklich geforderte & unbesetzte Slots rot markieren
-            def highlight_unfilled(data):
-                styles = pd.DataFrame("", index=data.index, columns=data.columns)
-                for slot in data.index:
-                    for b in data.columns:
-                        if df_demand.at[slot, b] and data.at[slot, b] == '-':
-                            styles.at[slot, b] = 'background-color: #FFC7CE'
-                return styles
+            styles = pd.DataFrame(
+                np.where(_unfilled_mask(df_pivot, df_demand), 'background-color: #FFC7CE', ''),
+                index=df_pivot.index, columns=df_pivot.columns
+            )
 
             st.subheader("Wöchentlicher Dienstplan")
             st.dataframe(
-                df_pivot.style.apply(highlight_unfilled, axis=None),
-                use_container_width=True
+                df_pivot.style.apply(lambda _: styles, axis=None),
+                width='stretch'
             )
 
             # Excel-Export
             st.subheader("Export")
-            excel_data = create_excel_export(df_pivot, df_demand, plan)
+            now = datetime.now()
+            ts = now.strftime('%Y%m%d_%H%M')
+            # Export-Inhalte erst beim Klick erzeugen (Callable statt fertiger Bytes)
             st.download_button(
                 label="📊 Als Excel-Datei herunterladen",
-                data=excel_data,
-                file_name=f"Dienstplan_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.xlsx",
+                data=lambda: create_excel_export(df_pivot, df_demand, plan if include_raw_data else None),
+                file_name=f"Dienstplan_{ts}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
 
             # CSV-/HTML-Export
             col1, col2 = st.columns(2)
             with col1:
-                csv_data = df_pivot.to_csv(index=True).encode('utf-8')
                 st.download_button(
                     label="📄 Als CSV herunterladen",
-                    data=csv_data,
-                    file_name=f"Dienstplan_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.csv",
+                    data=lambda: create_csv_export(df_pivot),
+                    file_name=f"Dienstplan_{ts}.csv",
                     mime="text/csv"
                 )
             with col2:
-                html_data = df_pivot.to_html(table_id="dienstplan")
-                html_full = f"""
-                <!DOCTYPE html><html><head><title>Dienstplan</title>
-                <style>#dienstplan{{border-collapse:collapse;width:100%;}}
-                #dienstplan th,#dienstplan td{{border:1px solid #ddd;padding:8px;text-align:center;}}
-                #dienstplan th{{background-color:#f2f2f2;font-weight:bold;}}
-                @media print{{body{{margin:0;}}}}</style></head><body>
-                <h1>Wöchentlicher Dienstplan</h1>
-                <p>Erstellt am: {pd.Timestamp.now().strftime('%d.%m.%Y %H:%M')}</p>
-                {html_data}
-                </body></html>
-                """
                 st.download_button(
                     label="🖨️ Als HTML (Drucken)",
-                    data=html_full.encode('utf-8'),
-                    file_name=f"Dienstplan_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.html",
+                    data=lambda: create_html_export(df_pivot, now.strftime('%d.%m.%Y %H:%M')),
+                    file_name=f"Dienstplan_{ts}.html",
                     mime="text/html"
                 )
         else:
@@ -418,22 +618,22 @@ if st.session_state.config_loaded:
         st.session_state.helpers_cfg.clear()
         st.session_state.current_plan = None
         st.session_state.current_pivot = None
-        st.experimental_rerun()  # Neuer Start, damit Session State zurückgesetzt wird
+        st.rerun()  # Neuer Start, damit Session State zurückgesetzt wird
     if st.sidebar.button("🗑️ Reset Konfiguration"):
         st.session_state.bereiche_cfg.clear()
         st.session_state.helpers_cfg.clear()
         st.session_state.current_plan = None
         st.session_state.current_pivot = None
-        st.experimental_rerun()
+        st.rerun()
 
     if st.session_state.config_data:
         st.sidebar.header("📋 Config-Info")
-        meta = st.session_state.config_data.get('meta', {})
+        meta = st.session_state.config_data.meta
         st.sidebar.info(f"""
         **Praxis:** {meta.get('praxis_name','Unbekannt')}
         **Version:** {meta.get('version','Unbekannt')}
-        **Bereiche:** {len(st.session_state.config_data['bereiche'])}
-        **Mitarbeiter:** {len(st.session_state.config_data['mitarbeiter'])}
+        **Bereiche:** {len(st.session_state.config_data.bereiche)}
+        **Mitarbeiter:** {len(st.session_state.config_data.mitarbeiter)}
         """)
 else:
     st.sidebar.info("🔧 Bitte Config-Datei laden")
@@ -441,7 +641,7 @@ else:
 # --- Sidebar Info ---
 st.sidebar.header("Export-Formate")
 st.sidebar.info("""
-**Excel (.xlsx)**: Vollständig formatierte Tabelle mit separatem Raw-Data Sheet  
+**Excel (.xlsx)**: Vollständig formatierte Tabelle, optional mit separatem Raw-Data Sheet  
 **CSV (.csv)**: Einfaches Komma-getrenntes Format  
 **HTML (.html)**: Druckfreundliches Format
 """)